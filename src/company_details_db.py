@@ -1,5 +1,8 @@
 import sqlite3
 import logging
+import queue
+import threading
+import time
 from pathlib import Path
 from typing import Optional
 from models import CompanyDetails
@@ -9,13 +12,138 @@ logger = logging.getLogger('company_details')
 logger.setLevel(logging.DEBUG)
 
 class CompanyDetailsDB:
+    # Consecutive flush failures tolerated before a batch is dropped, so a
+    # persistently broken DB (disk full, locked file) can't make
+    # flush_failed_attempts()/close() block on queue.join() forever
+    _MAX_FLUSH_RETRIES = 3
+
     def __init__(self, db_path="company_details.db"):
         self.db_path = Path(db_path)
+        # Single long-lived connection in autocommit mode so repeated
+        # store/lookup calls don't pay a file open + fsync each time.
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._apply_pragmas()
         self.init_db()
 
+        # SQL text kept stable on the instance so sqlite3's statement cache
+        # reuses the compiled plans instead of re-parsing per call
+        self._stmt_processed = '''
+            SELECT 1 FROM company_details WHERE kvk_number = ?
+            UNION ALL
+            SELECT 1 FROM failed_attempts WHERE kvk_number = ?
+            LIMIT 1
+        '''
+        self._stmt_store_details = '''
+            INSERT INTO company_details
+            (kvk_number, company_name, industries, employee_range,
+             headquarters_location, business_description, confidence_score,
+             homepage_url, linkedin_url, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(kvk_number) DO UPDATE SET
+                company_name = excluded.company_name,
+                industries = excluded.industries,
+                employee_range = excluded.employee_range,
+                headquarters_location = excluded.headquarters_location,
+                business_description = excluded.business_description,
+                confidence_score = excluded.confidence_score,
+                homepage_url = excluded.homepage_url,
+                linkedin_url = excluded.linkedin_url,
+                updated_at = CURRENT_TIMESTAMP
+        '''
+        self._stmt_store_failed = '''
+            INSERT INTO failed_attempts
+            (kvk_number, company_name, failure_reason)
+            VALUES (?, ?, ?)
+            ON CONFLICT(kvk_number) DO UPDATE SET
+                company_name = excluded.company_name,
+                failure_reason = excluded.failure_reason,
+                attempt_count = attempt_count + 1,
+                last_failed_at = CURRENT_TIMESTAMP
+        '''
+
+        # The flusher thread and callers share one autocommit connection;
+        # explicit BEGIN/COMMIT pairs must never interleave or one
+        # thread's ROLLBACK tears down the other's in-flight transaction
+        self._txn_lock = threading.Lock()
+
+        # Failure writes are informational only: queue them and flush in
+        # batches from a daemon thread so callers never block on a commit
+        self._failed_queue = queue.Queue()
+        self._failed_flusher = threading.Thread(
+            target=self._flush_failed_loop, daemon=True, name='failed-attempt-flusher')
+        self._failed_flusher.start()
+
+    def _apply_pragmas(self):
+        """Tune the connection once instead of per-call open/close"""
+        # page_size only takes effect on a freshly created database; no-op otherwise
+        self.conn.execute('PRAGMA page_size=8192')
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        self.conn.execute('PRAGMA cache_size=-65536')
+        # Map the file read-only into the process so lookups hit the page
+        # cache instead of read() syscalls (256 MiB cap)
+        self.conn.execute('PRAGMA mmap_size=268435456')
+
+    def close(self):
+        self.flush_failed_attempts()
+        self.conn.close()
+
+    def flush_failed_attempts(self):
+        """Block until all queued failed-attempt writes have been flushed"""
+        self._failed_queue.join()
+
+    def _flush_failed_loop(self):
+        """Drain queued failed attempts and write them in one transaction.
+
+        Runs forever on a daemon thread; waking roughly once per batch keeps
+        write amplification low without delaying shutdown (close() joins the
+        queue first)."""
+        failures = 0  # consecutive flush failures
+        while True:
+            rows = [self._failed_queue.get()]
+            try:
+                while True:
+                    rows.append(self._failed_queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                with self._txn_lock:
+                    self.conn.execute('BEGIN')
+                    try:
+                        self.conn.executemany(self._stmt_store_failed, rows)
+                        self.conn.execute('COMMIT')
+                    except Exception:
+                        if self.conn.in_transaction:
+                            self.conn.execute('ROLLBACK')
+                        raise
+                failures = 0
+            except Exception as e:
+                failures += 1
+                if failures < self._MAX_FLUSH_RETRIES:
+                    # Put the rows back for a later pass instead of
+                    # dropping them; re-queue before task_done so
+                    # queue.join() can't observe an empty queue mid-retry
+                    logger.error(
+                        f"Failed to flush {len(rows)} failed attempts "
+                        f"(attempt {failures}/{self._MAX_FLUSH_RETRIES}): {e}")
+                    for row in rows:
+                        self._failed_queue.put(row)
+                else:
+                    # The DB is persistently broken; dropping the batch is
+                    # the only way to let queue.join() (and shutdown) finish
+                    logger.error(
+                        f"Dropping {len(rows)} failed attempts after "
+                        f"{failures} consecutive flush failures: {e}")
+                    failures = 0
+            finally:
+                for _ in rows:
+                    self._failed_queue.task_done()
+            time.sleep(1)
+
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
+        self.conn.execute('''
                 CREATE TABLE IF NOT EXISTS company_details (
                     kvk_number TEXT PRIMARY KEY,
                     company_name TEXT NOT NULL,
@@ -30,9 +158,9 @@ class CompanyDetailsDB:
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
-            
-            # Create failed attempts table
-            conn.execute('''
+
+        # Create failed attempts table
+        self.conn.execute('''
                 CREATE TABLE IF NOT EXISTS failed_attempts (
                     kvk_number TEXT PRIMARY KEY,
                     company_name TEXT NOT NULL,
@@ -42,85 +170,117 @@ class CompanyDetailsDB:
                     last_failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
-            conn.commit()
-            logger.debug("Company details database initialized")
+
+        # Normalized industries so aggregations are plain GROUP BY queries
+        # instead of JSON parsing over every row
+        self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS company_industries (
+                    kvk_number TEXT NOT NULL,
+                    industry TEXT NOT NULL,
+                    PRIMARY KEY (kvk_number, industry)
+                )
+            ''')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_ci_industry ON company_industries(industry)')
+
+        # Secondary indexes for the ORDER BY / range-filter read paths
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_fa_last ON failed_attempts(last_failed_at DESC)')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_cd_conf ON company_details(confidence_score DESC)')
+        logger.debug("Company details database initialized")
 
     def has_been_processed(self, kvk_number: str) -> bool:
         """Check if company has already been processed successfully OR failed"""
-        with sqlite3.connect(self.db_path) as conn:
-            # Check if successfully processed
-            cursor = conn.execute(
-                'SELECT kvk_number FROM company_details WHERE kvk_number = ?', 
-                (kvk_number,)
-            )
-            if cursor.fetchone() is not None:
-                return True
-                
-            # Check if failed
-            cursor = conn.execute(
-                'SELECT kvk_number FROM failed_attempts WHERE kvk_number = ?', 
-                (kvk_number,)
-            )
-            return cursor.fetchone() is not None
+        # One round-trip covering both the success and failure tables
+        cursor = self.conn.execute(self._stmt_processed, (kvk_number, kvk_number))
+        return cursor.fetchone() is not None
 
     def store_company_details(self, kvk_number: str, company_name: str, details: CompanyDetails):
         """Store company details from Perplexity response"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                INSERT OR REPLACE INTO company_details 
-                (kvk_number, company_name, industries, employee_range, 
-                 headquarters_location, business_description, confidence_score,
-                 homepage_url, linkedin_url, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (
-                kvk_number,
-                company_name,
-                json.dumps(details.industries),
-                details.employee_range,
-                details.headquarters_location,
-                details.business_description,
-                details.confidence_score,
-                details.homepage_url,
-                details.linkedin_url
-            ))
-            conn.commit()
-            logger.info(f"Stored details for {company_name} (KvK {kvk_number})")
+        with self._txn_lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.execute(self._stmt_store_details, (
+                    kvk_number,
+                    company_name,
+                    json.dumps(details.industries),
+                    details.employee_range,
+                    details.headquarters_location,
+                    details.business_description,
+                    details.confidence_score,
+                    str(details.homepage_url) if details.homepage_url else '',
+                    str(details.linkedin_url) if details.linkedin_url else ''
+                ))
+                # Keep the normalized side table in sync within the same transaction
+                self.conn.execute('DELETE FROM company_industries WHERE kvk_number = ?', (kvk_number,))
+                self.conn.executemany(
+                    'INSERT INTO company_industries (kvk_number, industry) VALUES (?, ?)',
+                    [(kvk_number, industry) for industry in details.industries])
+                self.conn.execute('COMMIT')
+            except Exception:
+                if self.conn.in_transaction:
+                    self.conn.execute('ROLLBACK')
+                raise
+        logger.info(f"Stored details for {company_name} (KvK {kvk_number})")
+
+    def store_company_details_bulk(self, rows):
+        """Store many (kvk_number, company_name, details) tuples in one
+        transaction — one fsync per batch instead of per company"""
+        if not rows:
+            return
+        with self._txn_lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.executemany(self._stmt_store_details, [(
+                    kvk_number,
+                    company_name,
+                    json.dumps(details.industries),
+                    details.employee_range,
+                    details.headquarters_location,
+                    details.business_description,
+                    details.confidence_score,
+                    str(details.homepage_url) if details.homepage_url else '',
+                    str(details.linkedin_url) if details.linkedin_url else ''
+                ) for kvk_number, company_name, details in rows])
+                self.conn.executemany(
+                    'DELETE FROM company_industries WHERE kvk_number = ?',
+                    [(kvk_number,) for kvk_number, _, _ in rows])
+                self.conn.executemany(
+                    'INSERT INTO company_industries (kvk_number, industry) VALUES (?, ?)',
+                    [(kvk_number, industry)
+                     for kvk_number, _, details in rows
+                     for industry in details.industries])
+                self.conn.execute('COMMIT')
+            except Exception:
+                if self.conn.in_transaction:
+                    self.conn.execute('ROLLBACK')
+                raise
+        logger.info(f"Stored details for {len(rows)} companies in one batch")
 
     def store_failed_attempt(self, kvk_number: str, company_name: str, failure_reason: str):
-        """Store a failed processing attempt"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                INSERT OR REPLACE INTO failed_attempts 
-                (kvk_number, company_name, failure_reason, attempt_count, 
-                 first_failed_at, last_failed_at)
-                VALUES (?, ?, ?, 
-                    COALESCE((SELECT attempt_count + 1 FROM failed_attempts WHERE kvk_number = ?), 1),
-                    COALESCE((SELECT first_failed_at FROM failed_attempts WHERE kvk_number = ?), CURRENT_TIMESTAMP),
-                    CURRENT_TIMESTAMP)
-            ''', (kvk_number, company_name, failure_reason, kvk_number, kvk_number))
-            conn.commit()
-            logger.info(f"Stored failed attempt for {company_name} (KvK {kvk_number}): {failure_reason}")
+        """Store a failed processing attempt (written asynchronously)"""
+        self._failed_queue.put((kvk_number, company_name, failure_reason))
+        logger.info(f"Queued failed attempt for {company_name} (KvK {kvk_number}): {failure_reason}")
 
     def get_failed_attempts(self) -> list:
         """Get all failed attempts"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
-                SELECT kvk_number, company_name, failure_reason, attempt_count,
-                       first_failed_at, last_failed_at
-                FROM failed_attempts 
-                ORDER BY last_failed_at DESC
-            ''')
-            return cursor.fetchall()
+        cursor = self.conn.execute('''
+            SELECT kvk_number, company_name, failure_reason, attempt_count,
+                   first_failed_at, last_failed_at
+            FROM failed_attempts
+            ORDER BY last_failed_at DESC
+        ''')
+        return cursor.fetchall()
 
     def get_companies_by_confidence(self, min_confidence: float = 0.0) -> list:
         """Get companies filtered by minimum confidence score"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
-                SELECT kvk_number, company_name, industries, employee_range, 
-                       headquarters_location, business_description, confidence_score,
-                       homepage_url, linkedin_url
-                FROM company_details 
-                WHERE confidence_score >= ?
-                ORDER BY confidence_score DESC
-            ''', (min_confidence,))
-            return cursor.fetchall()
+        cursor = self.conn.execute('''
+            SELECT kvk_number, company_name, industries, employee_range,
+                   headquarters_location, business_description, confidence_score,
+                   homepage_url, linkedin_url
+            FROM company_details
+            WHERE confidence_score >= ?
+            ORDER BY confidence_score DESC
+        ''', (min_confidence,))
+        return cursor.fetchall()
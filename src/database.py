@@ -8,55 +8,105 @@ logger.setLevel(logging.DEBUG)
 class CompanyDB:
     def __init__(self, db_path="companies.db"):
         self.db_path = Path(db_path)
+        # Single long-lived connection in autocommit mode; explicit BEGIN/COMMIT
+        # is used by callers that want to batch writes.
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._apply_pragmas()
         self.init_db()
 
+        # SQL text kept stable on the instance so sqlite3's statement cache
+        # reuses the compiled plans instead of re-parsing per call
+        self._stmt_checked = 'SELECT EXISTS(SELECT 1 FROM companies WHERE kvk_number = ?)'
+        self._stmt_failed = 'SELECT EXISTS(SELECT 1 FROM companies WHERE kvk_number = ? AND has_branches = -1)'
+        self._stmt_no_branches = 'SELECT EXISTS(SELECT 1 FROM companies WHERE kvk_number = ? AND has_branches = 0)'
+        self._stmt_store = '''INSERT INTO companies
+               (company_name, kvk_number, has_branches)
+               VALUES (?, ?, ?)
+               ON CONFLICT(kvk_number) DO UPDATE SET
+                   company_name = excluded.company_name,
+                   has_branches = excluded.has_branches'''
+
+    def _apply_pragmas(self):
+        """Tune the connection once instead of paying open/fsync costs per call"""
+        # page_size only takes effect on a freshly created database; no-op otherwise
+        self.conn.execute('PRAGMA page_size=8192')
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        self.conn.execute('PRAGMA cache_size=-65536')
+        # Map the file read-only into the process so lookups hit the page
+        # cache instead of read() syscalls (256 MiB cap)
+        self.conn.execute('PRAGMA mmap_size=268435456')
+
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS companies (
-                    company_name TEXT NOT NULL,
-                    kvk_number TEXT PRIMARY KEY,
-                    has_branches BOOLEAN
-                )
-            ''')
-            conn.commit()
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS companies (
+                company_name TEXT NOT NULL,
+                kvk_number TEXT PRIMARY KEY,
+                has_branches BOOLEAN
+            )
+        ''')
+
+    def begin(self):
+        """Start an explicit transaction for batched writes"""
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN')
+
+    def commit(self):
+        """Commit any open explicit transaction"""
+        if self.conn.in_transaction:
+            self.conn.execute('COMMIT')
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def load_processed_set(self):
+        """Load all already-checked KvK numbers in one bulk read.
+
+        Lets callers replace per-row has_been_checked queries with an
+        in-memory membership test."""
+        return {row[0] for row in self.conn.execute('SELECT kvk_number FROM companies')}
+
+    def get_all_checked_kvks(self):
+        """All KvK numbers with any stored result, as a frozenset"""
+        return frozenset(
+            row[0] for row in self.conn.execute('SELECT kvk_number FROM companies'))
+
+    def get_failed_kvks(self):
+        """KvK numbers with a failed result (-1), as a frozenset"""
+        return frozenset(row[0] for row in self.conn.execute(
+            'SELECT kvk_number FROM companies WHERE has_branches = -1'))
+
+    def get_no_branches_kvks(self):
+        """KvK numbers marked as having no branches (0), as a frozenset"""
+        return frozenset(row[0] for row in self.conn.execute(
+            'SELECT kvk_number FROM companies WHERE has_branches = 0'))
 
     def has_been_checked(self, kvk_number):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                'SELECT has_branches FROM companies WHERE kvk_number = ?', 
-                (kvk_number,)
-            )
-            result = cursor.fetchone()
-            return result is not None
+        cursor = self.conn.execute(self._stmt_checked, (kvk_number,))
+        return bool(cursor.fetchone()[0])
 
     def is_failed_result(self, kvk_number):
         """Check if a company has a failed result (-1)"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                'SELECT has_branches FROM companies WHERE kvk_number = ? AND has_branches = -1', 
-                (kvk_number,)
-            )
-            result = cursor.fetchone()
-            return result is not None
+        cursor = self.conn.execute(self._stmt_failed, (kvk_number,))
+        return bool(cursor.fetchone()[0])
 
     def is_no_branches_result(self, kvk_number):
         """Check if a company was marked as having no branches (0)"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                'SELECT has_branches FROM companies WHERE kvk_number = ? AND has_branches = 0', 
-                (kvk_number,)
-            )
-            result = cursor.fetchone()
-            return result is not None
+        cursor = self.conn.execute(self._stmt_no_branches, (kvk_number,))
+        return bool(cursor.fetchone()[0])
 
     def store_result(self, company_name, kvk_number, has_branches):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                '''INSERT OR REPLACE INTO companies 
-                   (company_name, kvk_number, has_branches) 
-                   VALUES (?, ?, ?)''',
-                (company_name, kvk_number, has_branches)
-            )
-            conn.commit()
-            logger.debug(f"Stored result for {company_name} (KvK {kvk_number}): has_branches={has_branches}")
\ No newline at end of file
+        self.conn.execute(self._stmt_store, (company_name, kvk_number, has_branches))
+        logger.debug("Stored result for %s (KvK %s): has_branches=%s", company_name, kvk_number, has_branches)
+
+    def store_results_bulk(self, rows):
+        """Store many (company_name, kvk_number, has_branches) rows in one transaction"""
+        if not rows:
+            return
+        self.begin()
+        self.conn.executemany(self._stmt_store, rows)
+        self.commit()
+        logger.debug("Stored %d results in bulk", len(rows))
@@ -1,66 +1,101 @@
 import base64
 import argparse
 import gzip
+import io
+import sqlite3
 from pathlib import Path
 
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
 def encode_database(db_path):
     """Encode SQLite database to compressed base64 for Streamlit secrets"""
     db_path = Path(db_path)
-    
+
     if not db_path.exists():
         print(f"Error: Database file {db_path} not found")
         return
-    
+
     print(f"Encoding database: {db_path}")
-    
+
+    # Shrink the file before compressing: fold the WAL back in and
+    # reclaim free pages so the encoded payload is as small as possible.
+    # Switching to DELETE journal mode matters beyond size: the WAL flag
+    # persists in the file header, and sqlite3's deserialize() (used by
+    # the secrets dashboard) cannot serve WAL-mode images.
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+    original_size = db_path.stat().st_size
+    print(f"Original size: {original_size:,} bytes ({original_size/1024/1024:.2f} MB)")
+
+    # Stream-compress in 1 MiB chunks so the raw DB is never held in memory.
+    # zstd at level 19 compresses SQLite files denser and faster than gzip-9;
+    # fall back to gzip when zstandard isn't installed.
+    buf = io.BytesIO()
     with open(db_path, 'rb') as f:
-        db_data = f.read()
-    
-    print(f"Original size: {len(db_data):,} bytes ({len(db_data)/1024/1024:.2f} MB)")
-    
-    # Compress with maximum compression
-    compressed = gzip.compress(db_data, compresslevel=9)
-    print(f"Compressed size: {len(compressed):,} bytes ({len(compressed)/1024/1024:.2f} MB)")
-    print(f"Compression ratio: {(1-len(compressed)/len(db_data))*100:.1f}% reduction")
-    
-    # Encode to base64
-    encoded = base64.b64encode(compressed).decode('utf-8')
-    print(f"Final encoded size: {len(encoded):,} bytes ({len(encoded)/1024/1024:.2f} MB)")
-    
+        if zstd is not None:
+            secret_key = 'compressed_data_zstd'
+            cctx = zstd.ZstdCompressor(level=19)
+            with cctx.stream_writer(buf, closefd=False) as writer:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    writer.write(chunk)
+        else:
+            secret_key = 'compressed_data'
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9) as gz:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    gz.write(chunk)
+    compressed = buf.getvalue()
+    print(f"Compressed size ({'zstd' if zstd else 'gzip'}): "
+          f"{len(compressed):,} bytes ({len(compressed)/1024/1024:.2f} MB)")
+    print(f"Compression ratio: {(1-len(compressed)/original_size)*100:.1f}% reduction")
+
+    # encodebytes wraps at 76 chars per line, matching the old manual chunking
+    encoded = base64.encodebytes(compressed).decode('ascii')
+    encoded_size = len(encoded) - encoded.count('\n')
+    print(f"Final encoded size: {encoded_size:,} bytes ({encoded_size/1024/1024:.2f} MB)")
+
     # Check if it fits in Streamlit secrets (1MB limit)
-    if len(encoded) > 1024*1024:
+    if encoded_size > 1024*1024:
         print("⚠️  WARNING: Still exceeds 1MB limit for Streamlit Cloud secrets!")
         print("Consider using external hosting or splitting the data.")
     else:
         print("✅ Will fit in Streamlit Cloud secrets!")
-    
-    # Split into chunks for better readability in secrets
-    chunk_size = 76
-    chunks = [encoded[i:i+chunk_size] for i in range(0, len(encoded), chunk_size)]
-    
+
     print("\n" + "="*50)
     print("Copy this to your .streamlit/secrets.toml file:")
     print("="*50)
     print("[database]")
-    print('compressed_data = """')
-    for chunk in chunks:
-        print(chunk)
+    print(f'{secret_key} = """')
+    print(encoded, end='')
     print('"""')
     print("="*50)
-    
+
     # Also save to file for convenience
     secrets_file = db_path.parent / "secrets_database.txt"
     with open(secrets_file, 'w') as f:
         f.write("[database]\n")
-        f.write('compressed_data = """\n')
-        for chunk in chunks:
-            f.write(chunk + '\n')
+        f.write(f'{secret_key} = """\n')
+        f.write(encoded)
         f.write('"""\n')
-    
+
     print(f"\nAlso saved to: {secrets_file}")
     print("Add this file to your .gitignore!")
-    
-    return len(encoded) <= 1024*1024
+
+    return encoded_size <= 1024*1024
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Encode SQLite database for Streamlit secrets')
@@ -4,13 +4,60 @@ import json
 from pathlib import Path
 import argparse
 
+CHUNK_SIZE = 10_000
+
+def _make_writer(output_path):
+    """Prefer xlsxwriter (C-backed, faster writes); fall back to openpyxl.
+
+    constant_memory mode is deliberately NOT enabled: it freezes a row as
+    soon as a later row is touched, and pandas' to_excel emits cells
+    column-major, which leaves every column after the first blank. The
+    chunked reads already bound memory on their own."""
+    try:
+        return pd.ExcelWriter(output_path, engine='xlsxwriter')
+    except (ImportError, ModuleNotFoundError):
+        return pd.ExcelWriter(output_path, engine='openpyxl')
+
+def _prepare_chunk(df_chunk):
+    """Parse industries JSON for better readability"""
+    df_chunk = df_chunk.copy()
+    df_chunk['industries_parsed'] = df_chunk['industries'].apply(
+        lambda x: ', '.join(json.loads(x)) if x else ''
+    )
+    df_chunk = df_chunk.drop('industries', axis=1)
+    df_chunk = df_chunk.rename(columns={'industries_parsed': 'industries'})
+    return df_chunk
+
+def _industry_counts(conn):
+    """Industry breakdown, preferring the normalized company_industries table.
+
+    Databases written before that table existed (or populated before it was
+    kept in sync) fall back to unpacking the JSON column with json_each."""
+    table_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'company_industries'"
+    ).fetchone() is not None
+    if table_exists and conn.execute(
+            'SELECT EXISTS(SELECT 1 FROM company_industries)').fetchone()[0]:
+        return pd.read_sql_query("""
+            SELECT industry AS Industry, COUNT(*) AS Count
+            FROM company_industries
+            GROUP BY industry
+            ORDER BY Count DESC
+        """, conn)
+    return pd.read_sql_query("""
+        SELECT value AS Industry, COUNT(*) AS Count
+        FROM company_details, json_each(industries)
+        GROUP BY value
+        ORDER BY Count DESC
+    """, conn)
+
 def export_company_details_to_excel(db_path: str, output_path: str = "company_details.xlsx"):
     """Export company details database to Excel with multiple sheets"""
-    
+
     with sqlite3.connect(db_path) as conn:
         # Main data sheet
         main_query = """
-        SELECT 
+        SELECT
             kvk_number,
             company_name,
             industries,
@@ -21,71 +68,69 @@ def export_company_details_to_excel(db_path: str, output_path: str = "company_de
             homepage_url,
             linkedin_url,
             DATE(created_at) as processed_date
-        FROM company_details 
+        FROM company_details
         ORDER BY confidence_score DESC, company_name
         """
-        
-        df_main = pd.read_sql_query(main_query, conn)
-        
-        # Parse industries JSON for better readability
-        df_main['industries_parsed'] = df_main['industries'].apply(
-            lambda x: ', '.join(json.loads(x)) if x else ''
-        )
-        df_main = df_main.drop('industries', axis=1)
-        df_main = df_main.rename(columns={'industries_parsed': 'industries'})
-        
-        # Summary statistics
-        summary_data = {
-            'Metric': [
-                'Total Companies',
-                'High Confidence (≥0.8)',
-                'Medium Confidence (0.5-0.8)',
-                'Low Confidence (<0.5)',
-                'Companies with Homepage',
-                'Companies with LinkedIn',
-                'Average Confidence Score'
-            ],
-            'Count': [
-                len(df_main),
-                len(df_main[df_main['confidence_score'] >= 0.8]),
-                len(df_main[(df_main['confidence_score'] >= 0.5) & (df_main['confidence_score'] < 0.8)]),
-                len(df_main[df_main['confidence_score'] < 0.5]),
-                len(df_main[df_main['homepage_url'] != '']),
-                len(df_main[df_main['linkedin_url'] != '']),
-                round(df_main['confidence_score'].mean(), 2)
-            ]
-        }
-        df_summary = pd.DataFrame(summary_data)
-        
-        # Industry breakdown
-        industry_breakdown = []
-        for industries_str in df_main['industries']:
-            if industries_str:
-                for industry in industries_str.split(', '):
-                    industry_breakdown.append(industry.strip())
-        
-        df_industries = pd.DataFrame(industry_breakdown, columns=['Industry'])
-        df_industries = df_industries['Industry'].value_counts().reset_index()
-        df_industries.columns = ['Industry', 'Count']
-        
-        # Employee range distribution
-        df_employees = df_main['employee_range'].value_counts().reset_index()
-        df_employees.columns = ['Employee Range', 'Count']
-        
-        # Export to Excel with multiple sheets
-        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-            df_main.to_excel(writer, sheet_name='Company Details', index=False)
+
+        with _make_writer(output_path) as writer:
+            # Stream the main sheet chunk by chunk
+            total_rows = 0
+            for df_chunk in pd.read_sql_query(main_query, conn, chunksize=CHUNK_SIZE):
+                df_chunk = _prepare_chunk(df_chunk)
+                df_chunk.to_excel(
+                    writer, sheet_name='Company Details', index=False,
+                    header=(total_rows == 0), startrow=total_rows + (1 if total_rows else 0)
+                )
+                total_rows += len(df_chunk)
+
+            # Summary statistics, aggregated inside SQLite instead of
+            # re-scanning a DataFrame per metric
+            summary_row = conn.execute("""
+                SELECT
+                    COUNT(*),
+                    COUNT(*) FILTER (WHERE confidence_score >= 0.8),
+                    COUNT(*) FILTER (WHERE confidence_score >= 0.5 AND confidence_score < 0.8),
+                    COUNT(*) FILTER (WHERE confidence_score < 0.5),
+                    COUNT(*) FILTER (WHERE homepage_url != ''),
+                    COUNT(*) FILTER (WHERE linkedin_url != ''),
+                    ROUND(AVG(confidence_score), 2)
+                FROM company_details
+            """).fetchone()
+            summary_data = {
+                'Metric': [
+                    'Total Companies',
+                    'High Confidence (≥0.8)',
+                    'Medium Confidence (0.5-0.8)',
+                    'Low Confidence (<0.5)',
+                    'Companies with Homepage',
+                    'Companies with LinkedIn',
+                    'Average Confidence Score'
+                ],
+                'Count': list(summary_row[:6]) + [summary_row[6] if summary_row[6] is not None else 0]
+            }
+            df_summary = pd.DataFrame(summary_data)
+
+            df_industries = _industry_counts(conn)
+
+            # Employee range distribution
+            df_employees = pd.read_sql_query("""
+                SELECT employee_range AS "Employee Range", COUNT(*) AS Count
+                FROM company_details
+                GROUP BY employee_range
+                ORDER BY Count DESC
+            """, conn)
+
             df_summary.to_excel(writer, sheet_name='Summary', index=False)
             df_industries.to_excel(writer, sheet_name='Industries', index=False)
             df_employees.to_excel(writer, sheet_name='Employee Ranges', index=False)
-        
-        print(f"Exported {len(df_main)} companies to {output_path}")
+
+        print(f"Exported {total_rows} companies to {output_path}")
         return output_path
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Export company details to Excel')
     parser.add_argument('--db-path', default='./db/company_details.db', help='Database path')
     parser.add_argument('--output', default='company_details.xlsx', help='Output Excel file')
-    
+
     args = parser.parse_args()
-    export_company_details_to_excel(args.db_path, args.output)
\ No newline at end of file
+    export_company_details_to_excel(args.db_path, args.output)
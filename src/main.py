@@ -1,8 +1,14 @@
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from tqdm import tqdm
 import pandas as pd
 import argparse
-import re
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from datetime import datetime
 import os
 from database import CompanyDB
@@ -39,13 +45,6 @@ def setup_logging(level=logging.INFO, log_dir=None):
     console_handler.addFilter(lambda record: record.name == "__main__")
     root_logger.addHandler(console_handler)
     
-    # Configure module loggers
-    modules = {
-        'scraper': 'scraper.log',
-        'database': 'database.log',
-        'proxy': 'proxy.log'
-    }
-    
     # Add error logger for fatal errors
     error_logger = logging.getLogger('error')
     error_handler = logging.FileHandler(log_dir / 'fatal_errors.log')
@@ -53,54 +52,78 @@ def setup_logging(level=logging.INFO, log_dir=None):
     error_handler.setLevel(logging.ERROR)
     error_logger.addHandler(error_handler)
     error_logger.setLevel(logging.ERROR)
-    
-    for module, filename in modules.items():
-        logger = logging.getLogger(module)
-        logger.setLevel(logging.DEBUG)
-        
-        file_handler = logging.FileHandler(log_dir / filename)
-        file_handler.setFormatter(formatter)
-        file_handler.setLevel(logging.DEBUG)
-        logger.addHandler(file_handler)
-    
+
+    # One shared logfile behind a queue: module loggers enqueue records
+    # (never blocking a scraping thread on disk I/O) and a listener thread
+    # writes them through a single rotating handler. The %(name)s field in
+    # the formatter keeps the per-module attribution.
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    for module in ('scraper', 'database', 'proxy'):
+        module_logger = logging.getLogger(module)
+        module_logger.setLevel(logging.DEBUG)
+        module_logger.addHandler(queue_handler)
+
+    file_handler = RotatingFileHandler(
+        log_dir / 'kvk.log', maxBytes=128 * 1024 * 1024, backupCount=5)
+    file_handler.setFormatter(formatter)
+    file_handler.setLevel(logging.DEBUG)
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+
     # Quiet noisy loggers
     logging.getLogger('urllib3').setLevel(logging.WARNING)
     logging.getLogger('requests').setLevel(logging.WARNING)
-    
-    return error_logger  # Return error logger for fatal errors
 
-def clean_kvk_number(kvk):
-    """Clean and standardize KvK number format.
-    Handles floats, ints and strings, ensures 8-digit format."""
-    try:
-        # Handle float inputs first
-        if isinstance(kvk, float):
-            kvk = int(kvk)
-        
-        # Convert to string
-        kvk_str = str(kvk)
-        
-        # Extract only digits
-        digits = re.sub(r'\D', '', kvk_str)
-        
-        # Convert to integer to remove any leading zeros
-        number = int(digits)
-        
-        # Format back to 8-digit string
-        cleaned = f"{number:08d}"
-        
-        # Validate length
-        if len(cleaned) != 8:
-            logger.warning(f"Invalid KvK number length after cleaning: {kvk} -> {cleaned}")
-            return None
-            
-        return cleaned
-        
-    except Exception as e:
-        logger.error(f"Error cleaning KvK number {kvk}: {str(e)}")
-        return None
+    return error_logger, listener  # Error logger for fatal errors, listener for shutdown
 
-def create_big_company_database(input_file, db_path="companies.db", start_index=None, end_index=None, retry_failed=False, retry_small=False):
+class TokenBucket:
+    """Thread-safe token bucket keeping scrape submissions under a target rate.
+
+    acquire() blocks until a token is available; penalize() halves the refill
+    rate after a rate-limit response (additive recovery is left to restarts)."""
+    def __init__(self, rate=5.0, burst=5):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self):
+        with self.lock:
+            self.rate = max(0.5, self.rate / 2)
+            logging.getLogger(__name__).warning(
+                f"Rate limited; reducing scrape rate to {self.rate:.1f} req/s")
+
+def retry_with_backoff(fn, *args, max_retries=3, base=1.0, cap=30.0, jitter=0.5):
+    """Call fn(*args), retrying transient scraper errors with exponential
+    backoff plus jitter (capped at `cap` seconds). Re-raises after the
+    final attempt."""
+    for attempt in range(max_retries):
+        try:
+            return fn(*args)
+        except (RateLimitException, TimeoutException, ProxyConnectionException) as e:
+            if attempt == max_retries - 1:
+                raise
+            delay = min(cap, base * 2 ** attempt) * (1 + random.random() * jitter)
+            logging.getLogger(__name__).warning(
+                f"Transient error ({e}), retrying in {delay:.1f}s "
+                f"(attempt {attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+def create_big_company_database(input_file, db_path="companies.db", start_index=None, end_index=None, retry_failed=False, retry_small=False, workers=4, rate_limit=5.0):
     """
     Process companies and store results in SQL database
     Args:
@@ -110,26 +133,34 @@ def create_big_company_database(input_file, db_path="companies.db", start_index=
         end_index: Optional ending index for processing (exclusive)
         retry_failed: If True, retry companies that previously returned None (-1)
         retry_small: If True, retry companies that were marked as having no branches (0)
+        workers: Number of scraper threads; each thread owns its own browser.
+                 1 keeps the old serial behavior.
+        rate_limit: Target scrape rate in requests/second across all workers
     """
     logger.info(f"Reading input file: {input_file}")
-    df = pd.read_csv(input_file)
-    
-    # Handle index bounds
+
+    # Only parse the two columns we use, as typed strings, in bounded
+    # chunks so peak memory stays O(chunksize) regardless of input size.
+    # The index bounds are pushed into the reader instead of slicing
+    # after a full parse.
+    read_kwargs = dict(
+        usecols=['kvk_number', 'company_name'],
+        dtype={'kvk_number': 'string', 'company_name': 'string'},
+        chunksize=50_000
+    )
     if start_index is not None or end_index is not None:
         start = start_index if start_index is not None else 0
-        end = end_index if end_index is not None else len(df)
-        logger.info(f"Processing rows {start} to {end}")
-        df = df.iloc[start:end]
-    
-    total_companies = len(df)
-    logger.info(f"Processing {total_companies} companies")
-    
-    scraper = CompanyScraper()
+        logger.info(f"Processing rows {start} to {end_index if end_index is not None else 'end'}")
+        if start:
+            read_kwargs['skiprows'] = range(1, start + 1)
+        if end_index is not None:
+            read_kwargs['nrows'] = end_index - start
+
     db = CompanyDB(db_path)
-    
+
     # Add statistics counters
     stats = {
-        'total': total_companies,
+        'total': 0,
         'skipped_invalid_kvk': 0,
         'skipped_already_checked': 0,
         'none_results': 0,
@@ -139,63 +170,175 @@ def create_big_company_database(input_file, db_path="companies.db", start_index=
     
     current_index = start if start_index is not None else 0
     error_logger = logging.getLogger('error')
-    
-    try:
-        with tqdm(total=total_companies, desc="Processing companies", unit="company") as pbar:
-            for idx, (_, row) in enumerate(df.iterrows()):
-                current_index = idx + (start_index if start_index is not None else 0)
-                kvk = clean_kvk_number(row['kvk_number'])
-                company_name = row['company_name']
-                
-                if kvk is None:
-                    stats['skipped_invalid_kvk'] += 1
-                    logger.warning(f"Skipping invalid KvK number: {row['kvk_number']}")
-                    pbar.update(1)
+
+    # Bulk reads instead of a has_been_checked / is_failed_result /
+    # is_no_branches_result query per row
+    processed = db.load_processed_set()
+    failed = db.get_failed_kvks() if retry_failed else frozenset()
+    no_branches = db.get_no_branches_kvks() if retry_small else frozenset()
+
+    # Buffer results and flush with executemany so fsyncs are paid once
+    # per batch instead of once per row
+    FLUSH_EVERY = 500
+    pending = []
+
+    # Stream the CSV chunk by chunk, cleaning each chunk in one vectorized
+    # pass and filtering skip rows up front so the scrape loop (and worker
+    # threads) only ever see real work. itertuples avoids per-row boxing.
+    base_index = start_index if start_index is not None else 0
+    total_companies = 0
+    tasks = []  # (input row index, company_name, kvk, force_refresh)
+    for df in pd.read_csv(input_file, **read_kwargs):
+        # Vectorized mirror of utils.clean_kvk_number: strip ALL
+        # non-digits (extract would keep only the first digit run of
+        # e.g. "12.34.56.78"), then enforce 0 < n < 10**8 and zero-pad.
+        # Stays in string space throughout — an integer conversion would
+        # overflow int64 on arbitrarily long digit garbage and kill the
+        # run, where the scalar helper just returns None
+        digits = df['kvk_number'].astype('string').str.replace(r'\D', '', regex=True)
+        digits = digits.str.lstrip('0')
+        digits = digits.where((digits.str.len() > 0) & (digits.str.len() <= 8))
+        df = df.assign(kvk_clean=digits.str.zfill(8))
+
+        for idx, (company_name, kvk) in enumerate(
+                df[['company_name', 'kvk_clean']].itertuples(index=False, name=None),
+                start=total_companies):
+            if pd.isna(kvk):
+                kvk = None
+
+            if kvk is None:
+                stats['skipped_invalid_kvk'] += 1
+                logger.warning("Skipping invalid KvK number for %s", company_name)
+                continue
+
+            # Skip if already checked, unless we want to retry. Retries
+            # must bypass the scraper's memo cache, or the cached verdict
+            # just gets replayed and the retry run is a no-op.
+            force_refresh = False
+            if kvk in processed:
+                should_retry = kvk in failed or kvk in no_branches
+                if should_retry:
+                    force_refresh = True
+                    logger.debug("Retrying %s (KvK %s)", company_name, kvk)
+                else:
+                    stats['skipped_already_checked'] += 1
+                    logger.debug("Already processed %s (KvK %s)", company_name, kvk)
                     continue
-                    
-                # Skip if already checked, unless we want to retry
-                if db.has_been_checked(kvk):
-                    should_retry = (retry_failed and db.is_failed_result(kvk)) or \
-                                 (retry_small and db.is_no_branches_result(kvk))
-                    if should_retry:
-                        logger.debug(f"Retrying {company_name} (KvK {kvk})")
-                    else:
-                        stats['skipped_already_checked'] += 1
-                        logger.debug(f"Already processed {company_name} (KvK {kvk})")
-                        pbar.update(1)
-                        continue
-                
-                try:
-                    logger.debug(f"Processing company {company_name} ({kvk})")
-                    result = scraper.check_company_size(company_name, kvk)
-                    
-                    if result is not None:  # Valid response (True/False)
-                        stats['stored_true' if result else 'stored_false'] += 1
-                        db.store_result(company_name, kvk, result)
-                        logger.debug(f"Stored valid result: {result}")
-                    else:  # Error occurred (None)
-                        stats['none_results'] += 1
-                        db.store_result(company_name, kvk, -1)
-                        logger.debug("Stored error result (-1)")
-                    pbar.update(1)
-                    
-                except (RateLimitException, TimeoutException, ProxyConnectionException) as e:
-                    error_msg = f"Connection error at index {current_index}. Last company: {company_name} (KvK {kvk}). Error: {str(e)}"
-                    logger.error(error_msg)
-                    error_logger.error(error_msg)
-                    raise  # Re-raise to exit processing
-                    
-                except Exception as e:
-                    if 'invalid session id' in str(e):
-                        error_msg = f"Browser session disconnected at index {current_index}. Last company: {company_name} (KvK {kvk})"
+
+            tasks.append((idx + base_index, company_name, kvk, force_refresh))
+
+        total_companies += len(df)
+
+    stats['total'] = total_companies
+    logger.info(f"Processing {total_companies} companies")
+
+    # One browser per worker thread; Selenium drivers are not thread-safe
+    thread_state = threading.local()
+    limiter = TokenBucket(rate=rate_limit)
+
+    def scrape_task(task):
+        _, company_name, kvk, force_refresh = task
+        if not hasattr(thread_state, 'scraper'):
+            thread_state.scraper = CompanyScraper()
+        limiter.acquire()
+        # %-style args defer formatting until a handler actually wants the record
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Processing company %s (%s)", company_name, kvk)
+        return retry_with_backoff(
+            partial(thread_state.scraper.check_company_size, force_refresh=force_refresh),
+            company_name, kvk)
+
+    def record_result(company_name, kvk, result):
+        if result is not None:  # Valid response (True/False)
+            stats['stored_true' if result else 'stored_false'] += 1
+            pending.append((company_name, kvk, result))
+            logger.debug("Buffered valid result: %s", result)
+        else:  # Error occurred (None)
+            stats['none_results'] += 1
+            pending.append((company_name, kvk, -1))
+            logger.debug("Buffered error result (-1)")
+        if len(pending) >= FLUSH_EVERY:
+            db.store_results_bulk(pending)
+            pending.clear()
+
+    try:
+        with tqdm(total=total_companies, desc="Processing companies", unit="company",
+                  mininterval=0.5, miniters=100, smoothing=0.1) as pbar:
+            pbar.update(total_companies - len(tasks))
+
+            # Batch bar updates so per-row work is a counter increment, not
+            # a tqdm lock acquisition
+            _progress = [0]
+
+            def advance():
+                _progress[0] += 1
+                if _progress[0] >= 100:
+                    pbar.update(_progress[0])
+                    _progress[0] = 0
+
+            if workers > 1 and tasks:
+                # Overlap the network-bound scrapes across a thread pool
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = {executor.submit(scrape_task, task): task for task in tasks}
+                    for future in as_completed(futures):
+                        current_index, company_name, kvk, _ = futures[future]
+                        try:
+                            record_result(company_name, kvk, future.result())
+                            advance()
+
+                        except (RateLimitException, TimeoutException, ProxyConnectionException) as e:
+                            # Backoff retries are exhausted; record the failure
+                            # and keep the run (and warmed-up browsers) alive
+                            error_msg = f"Giving up on {company_name} (KvK {kvk}) at index {current_index} after retries: {str(e)}"
+                            logger.error(error_msg)
+                            error_logger.error(error_msg)
+                            if isinstance(e, RateLimitException):
+                                limiter.penalize()
+                            record_result(company_name, kvk, None)
+                            advance()
+
+                        except Exception as e:
+                            if 'invalid session id' in str(e):
+                                error_msg = f"Browser session disconnected at index {current_index}. Last company: {company_name} (KvK {kvk})"
+                                logger.error(error_msg)
+                                error_logger.error(error_msg)
+                                for pending_future in futures:
+                                    pending_future.cancel()
+                                raise
+                            logger.error(f"Unexpected error: {str(e)}")
+                            stats['none_results'] += 1
+                            pending.append((company_name, kvk, -1))
+                            advance()
+            else:
+                for task in tasks:
+                    current_index, company_name, kvk, _ = task
+                    try:
+                        record_result(company_name, kvk, scrape_task(task))
+                        advance()
+
+                    except (RateLimitException, TimeoutException, ProxyConnectionException) as e:
+                        error_msg = f"Giving up on {company_name} (KvK {kvk}) at index {current_index} after retries: {str(e)}"
                         logger.error(error_msg)
                         error_logger.error(error_msg)
-                        raise
-                    logger.error(f"Unexpected error: {str(e)}")
-                    stats['none_results'] += 1
-                    db.store_result(company_name, kvk, -1)
-                    pbar.update(1)
-    
+                        if isinstance(e, RateLimitException):
+                            limiter.penalize()
+                        record_result(company_name, kvk, None)
+                        advance()
+
+                    except Exception as e:
+                        if 'invalid session id' in str(e):
+                            error_msg = f"Browser session disconnected at index {current_index}. Last company: {company_name} (KvK {kvk})"
+                            logger.error(error_msg)
+                            error_logger.error(error_msg)
+                            raise
+                        logger.error(f"Unexpected error: {str(e)}")
+                        stats['none_results'] += 1
+                        pending.append((company_name, kvk, -1))
+                        advance()
+
+            # Flush whatever the batching held back
+            pbar.update(_progress[0])
+
     except RateLimitException:
         error_logger.error(f"Exiting due to rate limit at index {current_index}")
     except Exception as e:
@@ -204,6 +347,11 @@ def create_big_company_database(input_file, db_path="companies.db", start_index=
         else:
             error_logger.error(f"Fatal error at index {current_index}: {str(e)}")
     finally:
+        # Persist any buffered results before reporting, so a rate-limit
+        # exit still keeps partial progress
+        db.store_results_bulk(pending)
+        pending.clear()
+
         # Log statistics to both main and error loggers
         stats_message = f"Processing statistics (up to index {current_index}):"
         for key, value in stats.items():
@@ -224,11 +372,18 @@ if __name__ == "__main__":
                        help='Retry processing companies that previously failed (-1)')
     parser.add_argument('--retry-small', action='store_true',
                        help='Retry processing companies previously marked as having no branches (0)')
-    
+    parser.add_argument('--workers', type=int, default=4,
+                       help='Number of scraper threads, each with its own browser (default: 4, 1 = serial)')
+    parser.add_argument('--rate-limit', type=float, default=5.0,
+                       help='Target scrape rate in requests/second across all workers (default: 5.0)')
+
     args = parser.parse_args()
-    error_logger = setup_logging(log_dir=args.log_dir)
+    error_logger, log_listener = setup_logging(log_dir=args.log_dir)
     logger = logging.getLogger(__name__)
-    
+
     logger.info("Starting company processing")
-    create_big_company_database(args.input_file, args.db_path, args.start_index, args.end_index, args.retry_failed, args.retry_small)
-    logger.info("Processing complete")
+    try:
+        create_big_company_database(args.input_file, args.db_path, args.start_index, args.end_index, args.retry_failed, args.retry_small, args.workers, args.rate_limit)
+        logger.info("Processing complete")
+    finally:
+        log_listener.stop()
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, HttpUrl, TypeAdapter, field_validator
 from typing import List, Optional
 
 class CompanyDetails(BaseModel):
@@ -34,43 +34,36 @@ class CompanyDetails(BaseModel):
         le=1.0
     )
     
-    # Optional URL fields
-    homepage_url: Optional[str] = Field(
-        default="",
+    # Optional URL fields, parsed by pydantic-core instead of ad-hoc checks
+    homepage_url: Optional[HttpUrl] = Field(
+        default=None,
         description="Company homepage URL"
     )
-    
-    linkedin_url: Optional[str] = Field(
-        default="",
+
+    linkedin_url: Optional[HttpUrl] = Field(
+        default=None,
         description="Company LinkedIn page URL"
     )
-    
+
+    @field_validator('homepage_url', 'linkedin_url', mode='before')
+    @classmethod
+    def empty_url_to_none(cls, v):
+        # The API is prompted to return "" for unknown URLs
+        return None if v == '' else v
+
     @field_validator('industries')
     @classmethod
     def validate_industries(cls, v):
-        valid_industries = {
-            "Technology & Software", "Financial Services", "Manufacturing", 
-            "Healthcare & Pharmaceuticals", "Energy & Utilities", 
-            "Construction & Real Estate", "Transportation & Logistics",
-            "Retail & E-commerce", "Food & Beverages", "Education",
-            "Professional Services", "Media & Entertainment", 
-            "Telecommunications", "Agriculture", "Tourism & Hospitality",
-            "Automotive", "Chemical & Materials", "Aerospace & Defense",
-            "Government & Public Sector", "Non-profit"
-        }
-        for industry in v:
-            if industry not in valid_industries:
-                raise ValueError(f"Invalid industry: {industry}")
+        # Module-level frozenset so the valid set isn't rebuilt per validation
+        invalid = set(v) - _VALID_INDUSTRIES
+        if invalid:
+            raise ValueError(f"Invalid industry: {', '.join(sorted(invalid))}")
         return v
-    
+
     @field_validator('employee_range')
     @classmethod
     def validate_employee_range(cls, v):
-        valid_ranges = {
-            "1-10", "11-50", "51-200", "201-500", 
-            "501-1000", "1001-5000", "5000+", "Not Available"
-        }
-        if v not in valid_ranges:
+        if v not in _VALID_EMPLOYEE_RANGES:
             raise ValueError(f"Invalid employee range: {v}")
         return v
 
@@ -87,3 +80,12 @@ INDUSTRY_OPTIONS = [
 ]
 
 EMPLOYEE_RANGES = ["1-10", "11-50", "51-200", "201-500", "501-1000", "1001-5000", "5000+", "Not Available"]
+
+# Frozen lookup sets shared by the validators above (resolved at call time),
+# built once from the same constants used in the API prompts
+_VALID_INDUSTRIES = frozenset(INDUSTRY_OPTIONS)
+_VALID_EMPLOYEE_RANGES = frozenset(EMPLOYEE_RANGES)
+
+# Reusable validator bound once at import; prefer this over
+# CompanyDetails(**data) in per-response hot paths
+COMPANY_DETAILS_ADAPTER = TypeAdapter(CompanyDetails)
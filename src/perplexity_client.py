@@ -1,75 +1,300 @@
 import os
+import asyncio
+import hashlib
 import json
 import logging
+import sqlite3
+import time
 from typing import Optional
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import aiohttp
 from pydantic import ValidationError
-from models import CompanyDetails, INDUSTRY_OPTIONS, EMPLOYEE_RANGES
+from tenacity import (retry, retry_if_exception_type, stop_after_attempt,
+                      wait_exponential_jitter)
+from models import CompanyDetails, COMPANY_DETAILS_ADAPTER, INDUSTRY_OPTIONS, EMPLOYEE_RANGES
 from dotenv import dotenv_values
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 config = dotenv_values(".env")
 
+def _json_dumps(obj) -> bytes:
+    """Serialize with orjson when available (3-10x faster than stdlib)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+def _json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Bump when CompanyDetails changes shape so stale cached responses
+# don't validate against the new schema
+SCHEMA_VERSION = 1
+
+class TransientAPIError(Exception):
+    """Retryable HTTP status (429/5xx); carries Retry-After when the API sent one"""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Transient API error {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def _api_wait(retry_state):
+    """Honor the server's Retry-After when present, else exponential + jitter"""
+    exc = retry_state.outcome.exception()
+    if isinstance(exc, TransientAPIError) and exc.retry_after is not None:
+        return exc.retry_after
+    return wait_exponential_jitter(initial=1, max=30)(retry_state)
+
+class _ResponseCache:
+    """SQLite-backed cache of raw response texts with a TTL.
+
+    Phase 2 is idempotent per (model, company, kvk); re-runs after a crash
+    should not re-pay the API for companies already answered."""
+
+    def __init__(self, path, ttl_seconds=30 * 86400):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response_text TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        row = self.conn.execute(
+            'SELECT response_text, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        response_text, created_at = row
+        if time.time() - created_at > self.ttl_seconds:
+            self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            return None
+        return response_text
+
+    def set(self, key, response_text):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+            (key, response_text, time.time()))
+
+    def close(self):
+        self.conn.close()
+
 logger = logging.getLogger('perplexity')
 logger.setLevel(logging.DEBUG)
 
 class PerplexityClient:
-    def __init__(self):
+    def __init__(self, cache_path="./db/perp_cache.db"):
         self.api_key = config.get('PERPLEXITY_API_KEY')
         self.model = config.get('PERPLEXITY_MODEL', 'sonar-small')
         self.url = "https://api.perplexity.ai/chat/completions"
+        self.cache = _ResponseCache(cache_path) if cache_path else None
         
         if not self.api_key:
             raise ValueError("PERPLEXITY_API_KEY not found in .env file")
         
         self.headers = {"Authorization": f"Bearer {self.api_key}"}
 
-    def get_company_details(self, company_name: str, kvk_number: str) -> Optional[CompanyDetails]:
-        """Get company details from Perplexity API"""
-        try:
-            user_prompt = self._create_user_prompt(company_name, kvk_number)
-            system_prompt = self._create_system_prompt()
-            
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "max_tokens": 1000,
-                "response_format": {
-                    "type": "json_schema",
-                    "json_schema": {"schema": CompanyDetails.model_json_schema()},
-                }
+        # Persistent session so every call reuses the pooled TLS connection
+        # instead of handshaking with the API per request; transient HTTP
+        # errors are retried with backoff at the adapter level
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.headers['Content-Type'] = 'application/json'
+        # Connection-level retries only; retryable statuses are handled by
+        # tenacity in _call_api so Retry-After can be honored
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5)
+        )
+        self.session.mount('https://', adapter)
+
+        # Shared aiohttp session for the async path, created lazily inside
+        # the running event loop and reused across calls
+        self._aio_session = None
+
+        # The system prompt and response schema never change per call, so
+        # build them (and the payload skeleton) once instead of re-walking
+        # the pydantic model graph for every company
+        self._system_prompt = self._create_system_prompt()
+        self._base_payload = {
+            "model": self.model,
+            "max_tokens": 1000,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"schema": CompanyDetails.model_json_schema()},
             }
-            
-            logger.debug(f"Making API request for {company_name} with model: {self.model}")
-            
-            response = requests.post(self.url, headers=self.headers, json=payload, timeout=30)
-            
-            # Log response details for debugging
-            logger.debug(f"Response status: {response.status_code}")
-            
+        }
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _cache_key(self, company_name: str, kvk_number: str) -> str:
+        return hashlib.blake2b(
+            f"{self.model}|{company_name}|{kvk_number}|{SCHEMA_VERSION}".encode(),
+            digest_size=16).hexdigest()
+
+    def _build_payload(self, company_name: str, kvk_number: str) -> dict:
+        payload = dict(self._base_payload)
+        payload["messages"] = [
+            {"role": "system", "content": self._system_prompt},
+            {"role": "user", "content": self._create_user_prompt(company_name, kvk_number)}
+        ]
+        return payload
+
+    @retry(stop=stop_after_attempt(5),
+           wait=_api_wait,
+           retry=retry_if_exception_type((TransientAPIError,
+                                          requests.exceptions.ConnectionError,
+                                          requests.exceptions.Timeout)),
+           reraise=True)
+    def _call_api(self, payload: dict) -> Optional[dict]:
+        """POST the payload, retrying transient statuses with backoff.
+
+        A single 429/502 no longer burns the company for the whole run;
+        non-retryable errors return None as before."""
+        # stream=True defers reading the body until after the status
+        # check, so it is pulled through Python exactly once
+        with self.session.post(self.url, data=_json_dumps(payload),
+                               timeout=30, stream=True) as response:
+            logger.debug("Response status: %s", response.status_code)
+
+            if response.status_code in (429, 500, 502, 503, 504):
+                retry_after = response.headers.get('Retry-After')
+                raise TransientAPIError(
+                    response.status_code,
+                    float(retry_after) if retry_after and retry_after.isdigit() else None)
+
             if response.status_code != 200:
                 logger.error(f"API Error {response.status_code}: {response.text}")
                 return None
-            
-            response_data = response.json()
-            
+
+            return _json_loads(response.content)
+
+    @retry(stop=stop_after_attempt(5),
+           wait=_api_wait,
+           retry=retry_if_exception_type((TransientAPIError,
+                                          aiohttp.ClientConnectionError,
+                                          asyncio.TimeoutError)),
+           reraise=True)
+    async def _call_api_async(self, payload: dict) -> Optional[dict]:
+        """Async twin of _call_api: same transient-status policy, so the
+        concurrent batch path retries 429/5xx with Retry-After honored
+        instead of permanently failing the company"""
+        if self._aio_session is None or self._aio_session.closed:
+            self._aio_session = aiohttp.ClientSession(
+                headers={**self.headers, 'Content-Type': 'application/json'},
+                timeout=aiohttp.ClientTimeout(total=30))
+
+        async with self._aio_session.post(self.url, data=_json_dumps(payload)) as response:
+            if response.status in (429, 500, 502, 503, 504):
+                retry_after = response.headers.get('Retry-After')
+                raise TransientAPIError(
+                    response.status,
+                    float(retry_after) if retry_after and retry_after.isdigit() else None)
+
+            if response.status != 200:
+                logger.error(f"API Error {response.status}: {await response.text()}")
+                return None
+
+            return await response.json(loads=_json_loads)
+
+    async def get_company_details_async(self, company_name: str, kvk_number: str) -> Optional[CompanyDetails]:
+        """Async variant of get_company_details; many calls can overlap their
+        API round-trips on one shared connection-pooled session"""
+        try:
+            if self.cache is not None:
+                cached = self.cache.get(self._cache_key(company_name, kvk_number))
+                if cached is not None:
+                    logger.debug("Cache hit for %s (KvK %s)", company_name, kvk_number)
+                    return self._parse_response(cached, company_name)
+
+            payload = self._build_payload(company_name, kvk_number)
+
+            logger.debug("Making async API request for %s with model: %s", company_name, self.model)
+            response_data = await self._call_api_async(payload)
+            if response_data is None:
+                return None
+
+            if "choices" not in response_data or len(response_data["choices"]) == 0:
+                logger.error(f"Unexpected response structure: {response_data}")
+                return None
+
+            response_text = response_data["choices"][0]["message"]["content"]
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw response for %s: %s", company_name, response_text)
+
+            details = self._parse_response(response_text, company_name)
+            if details is not None and self.cache is not None:
+                self.cache.set(self._cache_key(company_name, kvk_number), response_text)
+            return details
+
+        except asyncio.CancelledError:
+            raise
+        except aiohttp.ClientError as e:
+            logger.error("Request error for %s: %s", company_name, e)
+            return None
+        except Exception as e:
+            logger.error("Error getting details for %s: %s", company_name, e)
+            return None
+
+    async def aclose(self):
+        """Close the shared aiohttp session"""
+        if self._aio_session is not None and not self._aio_session.closed:
+            await self._aio_session.close()
+
+    def get_company_details(self, company_name: str, kvk_number: str) -> Optional[CompanyDetails]:
+        """Get company details from Perplexity API"""
+        try:
+            if self.cache is not None:
+                cached = self.cache.get(self._cache_key(company_name, kvk_number))
+                if cached is not None:
+                    logger.debug("Cache hit for %s (KvK %s)", company_name, kvk_number)
+                    return self._parse_response(cached, company_name)
+
+            payload = self._build_payload(company_name, kvk_number)
+
+            logger.debug("Making API request for %s with model: %s", company_name, self.model)
+
+            response_data = self._call_api(payload)
+            if response_data is None:
+                return None
+
             # Check if response has expected structure
             if "choices" not in response_data or len(response_data["choices"]) == 0:
                 logger.error(f"Unexpected response structure: {response_data}")
                 return None
                 
             response_text = response_data["choices"][0]["message"]["content"]
-            logger.debug(f"Raw response for {company_name}: {response_text}")
-            
-            return self._parse_response(response_text, company_name)
-            
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw response for %s: %s", company_name, response_text)
+
+            details = self._parse_response(response_text, company_name)
+            if details is not None and self.cache is not None:
+                self.cache.set(self._cache_key(company_name, kvk_number), response_text)
+            return details
+
         except requests.exceptions.RequestException as e:
-            logger.error(f"Request error for {company_name}: {str(e)}")
+            logger.error("Request error for %s: %s", company_name, e)
             return None
         except Exception as e:
-            logger.error(f"Error getting details for {company_name}: {str(e)}")
+            logger.error("Error getting details for %s: %s", company_name, e)
             return None
 
     def _create_system_prompt(self) -> str:
@@ -122,14 +347,16 @@ class PerplexityClient:
     def _parse_response(self, response_text: str, company_name: str) -> Optional[CompanyDetails]:
         """Parse and validate Perplexity response"""
         try:
-            # Since we're using structured output, the response should be valid JSON
-            data = json.loads(response_text)
-            details = CompanyDetails(**data)
+            # Since we're using structured output, the response should be
+            # valid JSON; validate_json parses and validates in one
+            # pydantic-core pass without an intermediate dict
+            details = COMPANY_DETAILS_ADAPTER.validate_json(response_text)
             
-            logger.info(f"Successfully parsed details for {company_name} (confidence: {details.confidence_score})")
+            logger.info("Successfully parsed details for %s (confidence: %s)", company_name, details.confidence_score)
             return details
             
         except (json.JSONDecodeError, ValidationError) as e:
-            logger.error(f"Failed to parse response for {company_name}: {str(e)}")
-            logger.debug(f"Raw response: {response_text}")
+            logger.error("Failed to parse response for %s: %s", company_name, e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw response: %s", response_text)
             return None
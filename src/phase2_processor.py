@@ -1,6 +1,9 @@
+import asyncio
 import logging
 import argparse
+import queue
 import time
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from typing import List, Tuple
 import sqlite3
@@ -14,7 +17,34 @@ from models import CompanyDetails
 logger = logging.getLogger('phase2')
 logger.setLevel(logging.DEBUG)
 
+class _AsyncTokenBucket:
+    """asyncio twin of the Phase 1 token bucket: caps average QPS without
+    serializing in-flight requests the way a fixed per-call sleep does"""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.capacity = max(burst, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
 class Phase2Processor:
+    # Concurrent-path successes are buffered and written one transaction
+    # per this many rows instead of one commit per company
+    _FLUSH_EVERY = 50
+
     def __init__(self, phase1_db_path: str = "./db/companies.db", 
                  phase2_db_path: str = "./db/company_details.db"):
         self.phase1_db_path = Path(phase1_db_path)
@@ -28,37 +58,67 @@ class Phase2Processor:
         self.phase1_db = CompanyDB(self.phase1_db_path)
         self.phase2_db = CompanyDetailsDB(self.phase2_db_path)
         self.perplexity_client = PerplexityClient()
-        
+
+        # Pending (kvk, name, details) rows from the async batch path
+        self._pending = []
+
         logger.info("Phase 2 processor initialized")
 
     def get_companies_with_branches(self) -> List[Tuple[str, str]]:
         """Get companies from Phase 1 DB where has_branches = 1"""
         try:
-            with sqlite3.connect(self.phase1_db_path) as conn:
-                cursor = conn.execute('''
-                    SELECT company_name, kvk_number 
-                    FROM companies 
-                    WHERE has_branches = 1
-                    ORDER BY company_name
-                ''')
-                companies = cursor.fetchall()
-                logger.info(f"Found {len(companies)} companies with branches")
-                return companies
+            # Reuse the long-lived CompanyDB connection instead of paying a
+            # fresh open + PRAGMA replay per call
+            cursor = self.phase1_db.conn.execute('''
+                SELECT company_name, kvk_number
+                FROM companies
+                WHERE has_branches = 1
+                ORDER BY company_name
+            ''')
+            companies = cursor.fetchall()
+            logger.info(f"Found {len(companies)} companies with branches")
+            return companies
         except Exception as e:
             logger.error(f"Error fetching companies with branches: {str(e)}")
             return []
 
+    def _flush_pending(self):
+        """Write buffered async successes in one bulk transaction"""
+        pending, self._pending = self._pending, []
+        self.phase2_db.store_company_details_bulk(pending)
+
+    def close(self):
+        """Release database connections and the API session"""
+        self._flush_pending()
+        self.phase1_db.close()
+        self.phase2_db.close()
+        self.perplexity_client.close()
+
     def get_unprocessed_companies(self) -> List[Tuple[str, str]]:
         """Get companies that haven't been processed in Phase 2 yet"""
-        companies_with_branches = self.get_companies_with_branches()
-        unprocessed = []
-        
-        for company_name, kvk_number in companies_with_branches:
-            if not self.phase2_db.has_been_processed(kvk_number):
-                unprocessed.append((company_name, kvk_number))
-        
-        logger.info(f"Found {len(unprocessed)} unprocessed companies")
-        return unprocessed
+        try:
+            # One indexed anti-join across both databases instead of a
+            # has_been_processed round-trip per company
+            conn = self.phase1_db.conn
+            attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+            if 'phase2' not in attached:
+                conn.execute('ATTACH ? AS phase2', (str(self.phase2_db_path),))
+
+            unprocessed = conn.execute('''
+                SELECT c.company_name, c.kvk_number
+                FROM companies c
+                WHERE c.has_branches = 1
+                  AND NOT EXISTS (SELECT 1 FROM phase2.company_details d
+                                  WHERE d.kvk_number = c.kvk_number)
+                  AND NOT EXISTS (SELECT 1 FROM phase2.failed_attempts f
+                                  WHERE f.kvk_number = c.kvk_number)
+                ORDER BY c.company_name
+            ''').fetchall()
+            logger.info(f"Found {len(unprocessed)} unprocessed companies")
+            return unprocessed
+        except Exception as e:
+            logger.error(f"Error fetching unprocessed companies: {str(e)}")
+            return []
 
     def process_company(self, company_name: str, kvk_number: str) -> bool:
         """Process a single company through Perplexity API"""
@@ -85,8 +145,74 @@ class Phase2Processor:
             self.phase2_db.store_failed_attempt(kvk_number, company_name, failure_reason)
             return False
 
-    def run_batch_processing(self, max_companies: int = None, delay_seconds: float = 1.0):
-        """Run batch processing of companies"""
+    async def process_company_async(self, company_name: str, kvk_number: str) -> bool:
+        """Async counterpart of process_company, for the concurrent batch path"""
+        try:
+            logger.debug(f"Processing {company_name} (KvK: {kvk_number})")
+
+            details = await self.perplexity_client.get_company_details_async(company_name, kvk_number)
+
+            if details is None:
+                failure_reason = "No details returned from Perplexity API"
+                logger.warning(f"{failure_reason} for {company_name}")
+                self.phase2_db.store_failed_attempt(kvk_number, company_name, failure_reason)
+                return False
+
+            self._pending.append((kvk_number, company_name, details))
+            if len(self._pending) >= self._FLUSH_EVERY:
+                self._flush_pending()
+            logger.info(f"Successfully processed {company_name} (confidence: {details.confidence_score})")
+            return True
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            failure_reason = f"Processing error: {str(e)}"
+            logger.error(f"Error processing {company_name}: {str(e)}")
+            self.phase2_db.store_failed_attempt(kvk_number, company_name, failure_reason)
+            return False
+
+    async def _run_batch_async(self, companies, stats, delay_seconds: float, concurrency: int):
+        """Drive many API calls concurrently, bounded by a semaphore.
+
+        The semaphore caps in-flight requests while the token bucket caps
+        average QPS (1/delay_seconds), so raising concurrency no longer
+        multiplies the request rate."""
+        semaphore = asyncio.Semaphore(concurrency)
+        limiter = _AsyncTokenBucket(1.0 / delay_seconds) if delay_seconds > 0 else None
+
+        async def bounded(company_name, kvk_number):
+            async with semaphore:
+                if limiter is not None:
+                    await limiter.acquire()
+                return await self.process_company_async(company_name, kvk_number)
+
+        tasks = [asyncio.ensure_future(bounded(name, kvk)) for name, kvk in companies]
+        try:
+            with tqdm(total=len(companies), desc="Processing companies", unit="company") as pbar:
+                for future in asyncio.as_completed(tasks):
+                    success = await future
+                    if success:
+                        stats['processed'] += 1
+                    else:
+                        stats['failed'] += 1
+                    pbar.update(1)
+                    pbar.set_postfix({
+                        'Processed': stats['processed'],
+                        'Failed': stats['failed']
+                    })
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._flush_pending()
+            await self.perplexity_client.aclose()
+
+    def run_batch_processing(self, max_companies: int = None, delay_seconds: float = 1.0,
+                             concurrency: int = 1):
+        """Run batch processing of companies.
+
+        concurrency > 1 overlaps API round-trips via the async client;
+        the default keeps the original serial behavior."""
         unprocessed_companies = self.get_unprocessed_companies()
         
         if max_companies:
@@ -108,6 +234,11 @@ class Phase2Processor:
         }
         
         try:
+            if concurrency > 1:
+                asyncio.run(self._run_batch_async(
+                    unprocessed_companies, stats, delay_seconds, concurrency))
+                return
+
             with tqdm(total=total_companies, desc="Processing companies", unit="company") as pbar:
                 for idx, (company_name, kvk_number) in enumerate(unprocessed_companies):
                     try:
@@ -146,47 +277,61 @@ class Phase2Processor:
                 logger.info(f"  {key}: {value}")
 
 def setup_logging(log_dir: str = None):
-    """Setup logging for Phase 2 processing"""
+    """Setup logging for Phase 2 processing.
+
+    File writes go through a QueueHandler feeding a background
+    QueueListener, so disk I/O never blocks the request path. Returns the
+    listener; callers stop() it on shutdown."""
     if log_dir:
         log_dir = Path(log_dir)
     else:
         logs_dir = Path('./logs')
         logs_dir.mkdir(exist_ok=True)
         log_dir = logs_dir
-    
+
     formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
-    
+
     # Console handler
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
     console_handler.setLevel(logging.INFO)
-    
-    # File handlers
+
+    # File handlers, drained by the listener thread
     phase2_handler = logging.FileHandler(log_dir / 'phase2.log')
     phase2_handler.setFormatter(formatter)
     phase2_handler.setLevel(logging.DEBUG)
-    
+    phase2_handler.addFilter(lambda record: record.name in ('phase2', 'company_details'))
+
     perplexity_handler = logging.FileHandler(log_dir / 'perplexity.log')
     perplexity_handler.setFormatter(formatter)
     perplexity_handler.setLevel(logging.DEBUG)
-    
+    perplexity_handler.addFilter(lambda record: record.name == 'perplexity')
+
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    listener = QueueListener(log_queue, phase2_handler, perplexity_handler,
+                             respect_handler_level=True)
+    listener.start()
+
     # Setup loggers
     phase2_logger = logging.getLogger('phase2')
     phase2_logger.addHandler(console_handler)
-    phase2_logger.addHandler(phase2_handler)
+    phase2_logger.addHandler(queue_handler)
     phase2_logger.setLevel(logging.DEBUG)
-    
+
     perplexity_logger = logging.getLogger('perplexity')
-    perplexity_logger.addHandler(perplexity_handler)
+    perplexity_logger.addHandler(queue_handler)
     perplexity_logger.setLevel(logging.DEBUG)
-    
+
     company_details_logger = logging.getLogger('company_details')
-    company_details_logger.addHandler(phase2_handler)
+    company_details_logger.addHandler(queue_handler)
     company_details_logger.setLevel(logging.DEBUG)
 
+    return listener
+
 def main():
     parser = argparse.ArgumentParser(description='Phase 2: Process companies with Perplexity API')
     parser.add_argument('--phase1-db', type=str, default='./db/companies.db',
@@ -197,24 +342,31 @@ def main():
                        help='Maximum number of companies to process')
     parser.add_argument('--delay', type=float, default=1.0,
                        help='Delay between API calls in seconds (default: 1.0)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                       help='Number of API calls in flight at once (default: 1 = serial)')
     parser.add_argument('--log-dir', type=str,
                        help='Directory for log files')
     
     args = parser.parse_args()
     
     # Setup logging
-    setup_logging(args.log_dir)
-    
+    log_listener = setup_logging(args.log_dir)
+
+    processor = None
     try:
         # Initialize processor
         processor = Phase2Processor(args.phase1_db, args.phase2_db)
-        
+
         # Run processing
-        processor.run_batch_processing(args.max_companies, args.delay)
-        
+        processor.run_batch_processing(args.max_companies, args.delay, args.concurrency)
+
     except Exception as e:
         logger.error(f"Fatal error in Phase 2 processing: {str(e)}")
         raise
+    finally:
+        if processor is not None:
+            processor.close()
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
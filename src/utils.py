@@ -0,0 +1,34 @@
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+# Compiled once so clean_kvk_number skips the re module's cache lookup per call
+_NON_DIGIT_RE = re.compile(r'\D')
+
+def clean_kvk_number(kvk):
+    """Clean and standardize KvK number format.
+    Handles floats, ints and strings, ensures 8-digit format."""
+    # Fast paths: a clean CSV yields ints (or floats from NaN-padded
+    # columns), which don't need the regex engine at all
+    if isinstance(kvk, bool):
+        return None
+    if isinstance(kvk, int):
+        n = kvk
+    elif isinstance(kvk, float):
+        if math.isnan(kvk):
+            return None
+        n = int(kvk)
+    else:
+        digits = _NON_DIGIT_RE.sub('', str(kvk))
+        if not digits:
+            logger.error(f"Error cleaning KvK number {kvk}: no digits found")
+            return None
+        n = int(digits)
+
+    if not 0 < n < 10**8:
+        logger.warning(f"Invalid KvK number length after cleaning: {kvk} -> {n}")
+        return None
+
+    return f"{n:08d}"
@@ -1,102 +1,238 @@
 import streamlit as st
 import sqlite3
+import numpy as np
 import pandas as pd
 import json
 import plotly.express as px
 import tempfile
+import hashlib
 import os
 import base64
 import gzip
+from pathlib import Path
+from models import EMPLOYEE_RANGES
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
 
 st.set_page_config(page_title="Dutch Company Database", layout="wide")
 
+# Rows rendered in the table before the user asks for everything
+MAX_DISPLAY_ROWS = 500
+
+@st.cache_data
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """CSV payload for the download button, cached on the frame content"""
+    return df.to_csv(index=False).encode('utf-8')
+
+def _decode_db_bytes() -> bytes:
+    """Decode the secret database payload into raw SQLite bytes"""
+    database_secrets = st.secrets["database"]
+    # Prefer the zstd key written by newer encode_db.py runs.
+    if zstd is not None and "compressed_data_zstd" in database_secrets:
+        encoded = database_secrets["compressed_data_zstd"]
+    elif "compressed_data" in database_secrets:
+        encoded = database_secrets["compressed_data"]
+    elif "data" in database_secrets:
+        # Old uncompressed format for backward compatibility
+        encoded = database_secrets["data"]
+    else:
+        raise KeyError("Database secrets not found. Please check your secrets configuration.")
+
+    compressed_bytes = base64.b64decode(encoded)
+    if zstd is not None and "compressed_data_zstd" in database_secrets:
+        # decompressobj handles frames without a stored content size
+        return zstd.ZstdDecompressor().decompressobj().decompress(compressed_bytes)
+    if "compressed_data" in database_secrets:
+        try:
+            return gzip.decompress(compressed_bytes)
+        except gzip.BadGzipFile:
+            # Fallback: data might not be compressed
+            return compressed_bytes
+    return compressed_bytes
+
+@st.cache_resource
+def _db_connection() -> sqlite3.Connection:
+    """One shared read-only connection to the decoded database.
+
+    deserialize() (Python 3.11+) loads the bytes straight into an
+    in-memory database, skipping the write+reopen round-trip through a
+    temp file; older Pythons fall back to the on-disk path."""
+    db_data = _decode_db_bytes()
+
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    if hasattr(conn, 'deserialize'):
+        try:
+            conn.deserialize(db_data)
+            # deserialize() accepts WAL-mode images but can't serve
+            # them; probe now so the failure surfaces here and we fall
+            # back to the temp file instead of erroring on first query
+            conn.execute('SELECT 1 FROM sqlite_master LIMIT 1')
+        except sqlite3.OperationalError:
+            conn.close()
+        else:
+            # Supports the metrics aggregate below; in-memory DBs are writable
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_conf '
+                         'ON company_details(confidence_score)')
+            # All access after this point is reads
+            conn.execute('PRAGMA query_only=1')
+            return conn
+    else:
+        conn.close()
+
+    digest = hashlib.sha256(db_data).hexdigest()[:16]
+    db_path = Path(tempfile.gettempdir()) / f"dutch_companies_{digest}.db"
+    if not db_path.exists():
+        # Write-then-rename so concurrent workers never see a partial file
+        tmp_path = db_path.with_suffix('.tmp')
+        tmp_path.write_bytes(db_data)
+        os.replace(tmp_path, db_path)
+    # immutable=1 promises SQLite the file never changes, skipping
+    # locking and journal checks on every read
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro&immutable=1", uri=True,
+                           check_same_thread=False)
+    # 64MB page cache + mmap reads; the handle lives for the process,
+    # so repeated queries stay warm
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA query_only=1')
+    return conn
+
 @st.cache_data
 def load_data_from_secrets():
     """Load and cache company data from compressed base64 encoded database in secrets"""
     try:
-        # Get compressed base64 encoded database from secrets
-        try:
-            compressed_data = st.secrets["database"]["compressed_data"]
-        except KeyError:
-            # Fallback to old format for backward compatibility
-            try:
-                # Try to decompress old format first
-                old_data = st.secrets["database"]["data"]
-                db_data = base64.b64decode(old_data)
-            except:
-                st.error("Database secrets not found. Please check your secrets configuration.")
-                return None
-        else:
-            # Decode from base64
-            compressed_bytes = base64.b64decode(compressed_data)
-            
-            # Decompress
-            try:
-                db_data = gzip.decompress(compressed_bytes)
-            except gzip.BadGzipFile:
-                # Fallback: data might not be compressed
-                db_data = compressed_bytes
-        
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.db') as tmp_file:
-            tmp_file.write(db_data)
-            tmp_file_path = tmp_file.name
-        
-        try:
-            with sqlite3.connect(tmp_file_path) as conn:
-                query = """
-                SELECT 
-                    kvk_number,
-                    company_name,
-                    industries,
-                    employee_range,
-                    headquarters_location,
-                    business_description,
-                    confidence_score,
-                    homepage_url,
-                    linkedin_url,
-                    created_at
-                FROM company_details 
-                ORDER BY confidence_score DESC
-                """
-                df = pd.read_sql_query(query, conn)
-                
-                # Parse industries
-                df['industries_list'] = df['industries'].apply(
-                    lambda x: json.loads(x) if x else []
-                )
-                df['industries_str'] = df['industries_list'].apply(
-                    lambda x: ', '.join(x) if x else ''
-                )
-                
-                return df
-        finally:
-            # Clean up temporary file with retry logic
-            try:
-                if os.path.exists(tmp_file_path):
-                    os.unlink(tmp_file_path)
-            except PermissionError:
-                # File might still be locked, try again after a short delay
-                import time
-                time.sleep(0.1)
-                try:
-                    if os.path.exists(tmp_file_path):
-                        os.unlink(tmp_file_path)
-                except:
-                    # If we still can't delete it, just leave it (temp files are cleaned up eventually)
-                    pass
-            
+        conn = _db_connection()
+
+        # json_each shreds the JSON column inside SQLite, so the
+        # joined display string and the exploded (kvk, industry)
+        # view arrive ready-made — no Python parsing pass at all
+        query = """
+        SELECT
+            kvk_number,
+            company_name,
+            industries,
+            employee_range,
+            headquarters_location,
+            business_description,
+            confidence_score,
+            homepage_url,
+            linkedin_url,
+            created_at,
+            (SELECT group_concat(value, ', ')
+             FROM json_each(industries)) AS industries_str
+        FROM company_details
+        ORDER BY confidence_score DESC
+        """
+        df = pd.read_sql_query(query, conn)
+        df['industries_str'] = df['industries_str'].fillna('')
+        # Categorical codes make unique()/isin() integer compares
+        # instead of string hashing, and shrink the column to int8
+        df['employee_range'] = pd.Categorical(
+            df['employee_range'], categories=EMPLOYEE_RANGES, ordered=True)
+        # Arrow-backed strings keep text in contiguous buffers instead
+        # of per-cell PyObjects; locations repeat enough for category
+        df = df.astype({
+            'company_name': 'string[pyarrow]',
+            'headquarters_location': 'category',
+            'business_description': 'string[pyarrow]',
+            'homepage_url': 'string[pyarrow]',
+            'linkedin_url': 'string[pyarrow]',
+            'industries_str': 'string[pyarrow]',
+        })
+
+        # Exploded view shared by the sidebar options, the
+        # industry chart and the filters
+        df_exploded = pd.read_sql_query("""
+            SELECT kvk_number, value AS industries_list
+            FROM company_details, json_each(industries)
+        """, conn)
+        df_exploded['industries_list'] = df_exploded['industries_list'].astype('category')
+
+        return df, df_exploded
+
     except Exception as e:
         st.error(f"Error loading database from secrets: {str(e)}")
         return None
 
+@st.cache_data
+def compute_filtered(confidence_range: float, employee_ranges: tuple, industries: tuple):
+    """Filtered frame plus the chart and metric inputs derived from it.
+
+    Keyed on the filter combination only, so reruns triggered by widgets
+    that don't affect filtering (e.g. the display-column picker) reuse
+    the cached result instead of re-filtering and re-aggregating."""
+    df, df_exploded = load_data_from_secrets()
+
+    filtered_df = df[df['confidence_score'] >= confidence_range]
+
+    # Employee range filter - if none selected, show all
+    if employee_ranges:
+        filtered_df = filtered_df[filtered_df['employee_range'].isin(employee_ranges)]
+
+    # Industry filter - if none selected, show all
+    if industries:
+        # C-level isin over the exploded view instead of a Python
+        # any() callback per row
+        matching_kvks = df_exploded.loc[
+            df_exploded['industries_list'].isin(industries),
+            'kvk_number'
+        ].unique()
+        filtered_df = filtered_df[filtered_df['kvk_number'].isin(matching_kvks)]
+
+    # Industry distribution, counted in C over the exploded view
+    industry_counts = df_exploded.loc[
+        df_exploded['kvk_number'].isin(filtered_df['kvk_number']),
+        'industries_list'
+    ].value_counts()
+
+    # Confidence score distribution with 0.1 bins, binned in NumPy so
+    # the browser receives 10 bars instead of every raw score
+    hist_counts, hist_edges = np.histogram(
+        filtered_df['confidence_score'].to_numpy(), bins=10, range=(0, 1))
+
+    # The metrics row only needs four scalars, so aggregate inside
+    # SQLite (indexed on confidence_score) instead of scanning the
+    # filtered frame in pandas
+    metrics_query = """
+    SELECT COUNT(*),
+           COALESCE(AVG(confidence_score), 0),
+           COALESCE(SUM(homepage_url <> ''), 0),
+           COALESCE(SUM(linkedin_url <> ''), 0)
+    FROM company_details
+    WHERE confidence_score >= ?
+    """
+    params = [confidence_range]
+    if employee_ranges:
+        placeholders = ','.join('?' * len(employee_ranges))
+        metrics_query += f" AND employee_range IN ({placeholders})"
+        params.extend(employee_ranges)
+    if industries:
+        placeholders = ','.join('?' * len(industries))
+        metrics_query += (" AND EXISTS (SELECT 1 FROM json_each(company_details.industries)"
+                          f" WHERE value IN ({placeholders}))")
+        params.extend(industries)
+    total, avg_confidence, with_homepage, with_linkedin = (
+        _db_connection().execute(metrics_query, params).fetchone())
+    metrics = {
+        'total': total,
+        'avg_confidence': avg_confidence,
+        'with_homepage': with_homepage,
+        'with_linkedin': with_linkedin,
+    }
+
+    return filtered_df, industry_counts, hist_counts, hist_edges, metrics
+
 def main():
     st.title("🏢 Dutch Company Database Dashboard")
     
     # Load data automatically from secrets
-    df = load_data_from_secrets()
-    
-    if df is not None:
+    data = load_data_from_secrets()
+
+    if data is not None:
+        df, df_exploded = data
         st.success(f"Loaded {len(df)} companies from database")
         
         # Sidebar filters
@@ -111,66 +247,47 @@ def main():
             step=0.1
         )
         
-        # Employee range filter
-        employee_ranges = list(df['employee_range'].unique())
+        # Employee range filter; the option set is the fixed categorical
+        # domain, no per-rerun uniquing
         selected_employees = st.sidebar.multiselect(
             "Employee Range",
-            employee_ranges,
+            list(EMPLOYEE_RANGES),
             default=[]
         )
-        
+
         # Industry filter
-        all_industries = set()
-        for industries_list in df['industries_list']:
-            all_industries.update(industries_list)
-        
         selected_industries = st.sidebar.multiselect(
             "Industries",
-            sorted(all_industries),
+            sorted(df_exploded['industries_list'].cat.categories),
             default=[]
         )
         
-        # Apply filters
-        filtered_df = df[df['confidence_score'] >= confidence_range]
-        
-        # Employee range filter - if none selected, show all
-        if selected_employees:
-            filtered_df = filtered_df[filtered_df['employee_range'].isin(selected_employees)]
-        
-        # Industry filter - if none selected, show all
-        if selected_industries:
-            filtered_df = filtered_df[
-                filtered_df['industries_list'].apply(
-                    lambda x: any(industry in x for industry in selected_industries)
-                )
-            ]
-        
+        # Filtering and aggregation are cached on the filter tuple, so
+        # e.g. display-column changes don't recompute them
+        filtered_df, industry_counts, hist_counts, hist_edges, metrics = compute_filtered(
+            confidence_range,
+            tuple(sorted(selected_employees)),
+            tuple(sorted(selected_industries)))
+
         # Display metrics
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Total Companies", len(filtered_df))
+            st.metric("Total Companies", metrics['total'])
         with col2:
-            st.metric("Avg Confidence", f"{filtered_df['confidence_score'].mean():.2f}")
+            st.metric("Avg Confidence", f"{metrics['avg_confidence']:.2f}")
         with col3:
-            st.metric("With Homepage", len(filtered_df[filtered_df['homepage_url'] != '']))
+            st.metric("With Homepage", metrics['with_homepage'])
         with col4:
-            st.metric("With LinkedIn", len(filtered_df[filtered_df['linkedin_url'] != '']))
-        
+            st.metric("With LinkedIn", metrics['with_linkedin'])
+
         # Charts
         col1, col2 = st.columns(2)
-        
+
         with col1:
-            # Industry distribution
-            industry_counts = {}
-            for industries_list in filtered_df['industries_list']:
-                for industry in industries_list:
-                    industry_counts[industry] = industry_counts.get(industry, 0) + 1
-            
-            if industry_counts:
-                sorted_industries = sorted(industry_counts.items(), key=lambda x: x[1], reverse=True)
+            if not industry_counts.empty:
                 fig1 = px.bar(
-                    x=[count for industry, count in sorted_industries],
-                    y=[industry for industry, count in sorted_industries],
+                    x=industry_counts.values,
+                    y=industry_counts.index,
                     orientation='h',
                     title="Industries Distribution"
                 )
@@ -180,13 +297,10 @@ def main():
             st.plotly_chart(fig1, use_container_width=True)
         
         with col2:
-            # Confidence score distribution with 0.1 bins
-            fig2 = px.histogram(
-                filtered_df,
-                x='confidence_score',
-                title="Confidence Score Distribution",
-                nbins=10,
-                range_x=[0, 1]
+            fig2 = px.bar(
+                x=(hist_edges[:-1] + hist_edges[1:]) / 2,
+                y=hist_counts,
+                title="Confidence Score Distribution"
             )
             fig2.update_layout(
                 xaxis_title="Confidence Score",
@@ -207,22 +321,32 @@ def main():
         )
         
         if display_columns:
-            display_df = filtered_df[display_columns].copy()
-            
-            # Make URLs clickable
-            if 'homepage_url' in display_df.columns:
-                display_df['homepage_url'] = display_df['homepage_url'].apply(
-                    lambda x: f'<a href="{x}" target="_blank">{x}</a>' if x else ''
-                )
-            
+            # Nothing downstream mutates the selection, so a view is fine
+            display_df = filtered_df[display_columns]
+
+            # The browser only shows a screenful, so cap what gets
+            # serialized to it; the CSV below still covers everything
+            show_all = len(display_df) <= MAX_DISPLAY_ROWS or st.checkbox(
+                f"Show all {len(display_df)} rows "
+                f"(default: first {MAX_DISPLAY_ROWS})")
+
             st.write(f"Showing {len(display_df)} companies")
-            st.dataframe(display_df, use_container_width=True)
-            
-            # Download button
-            csv = display_df.to_csv(index=False)
+            # LinkColumn renders URLs client-side; no per-row anchor
+            # strings and the columns stay plain strings for the CSV
+            st.dataframe(
+                display_df if show_all else display_df.head(MAX_DISPLAY_ROWS),
+                use_container_width=True,
+                column_config={
+                    'homepage_url': st.column_config.LinkColumn(),
+                    'linkedin_url': st.column_config.LinkColumn(),
+                }
+            )
+
+            # Download button; the payload is cached per frame content so
+            # reruns don't re-encode it
             st.download_button(
                 label="Download as CSV",
-                data=csv,
+                data=to_csv_bytes(display_df),
                 file_name="filtered_companies.csv",
                 mime="text/csv"
             )
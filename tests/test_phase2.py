@@ -35,7 +35,14 @@ class TestPhase2Processor(unittest.TestCase):
 
     def setup_phase1_db(self):
         """Setup test Phase 1 database with sample data"""
-        with sqlite3.connect(self.phase1_db_path) as conn:
+        conn = sqlite3.connect(self.phase1_db_path)
+        # Same pragmas as the production DBs: WAL + relaxed syncs skip
+        # the per-statement fsyncs that dominate tiny test DB setup
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        # with conn: wraps the DDL and inserts in a single transaction
+        with conn:
             conn.execute('''
                 CREATE TABLE companies (
                     company_name TEXT,
@@ -43,7 +50,7 @@ class TestPhase2Processor(unittest.TestCase):
                     has_branches INTEGER
                 )
             ''')
-            
+
             # Insert test data
             test_companies = [
                 ("Company With Branches A", "12345678", 1),
@@ -52,12 +59,12 @@ class TestPhase2Processor(unittest.TestCase):
                 ("Failed Company", "45678901", -1),
                 ("Another Branch Company", "56789012", 1)
             ]
-            
+
             conn.executemany(
-                "INSERT INTO companies VALUES (?, ?, ?)", 
+                "INSERT INTO companies VALUES (?, ?, ?)",
                 test_companies
             )
-            conn.commit()
+        conn.close()
 
     def tearDown(self):
         # Cleanup temporary files
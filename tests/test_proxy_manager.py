@@ -14,7 +14,7 @@ class TestProxyManager(unittest.TestCase):
     def setUp(self):
         self.proxy_manager = ProxyManager(min_proxies=2)
         
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_fetch_free_proxies(self, mock_get):
         # Mock proxy list response with realistic HTML structure
         mock_response = Mock()
@@ -53,7 +53,7 @@ class TestProxyManager(unittest.TestCase):
         self.assertEqual(len(proxies), 1)
         self.assertEqual(proxies[0], "192.168.1.1:8080")
         
-    @patch('requests.get')
+    @patch('requests.Session.head')
     def test_validate_proxies(self, mock_get):
         test_proxies = ["192.168.1.1:8080", "192.168.1.2:8080"]
         
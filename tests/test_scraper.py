@@ -41,18 +41,23 @@ class TestRateLimit(unittest.TestCase):
     #         "False positive in rate limit detection"
     #     )
 
+@pytest.mark.serial
 class TestCompanyScraper(unittest.TestCase):
-    def setUp(self):
-        self.scraper = CompanyScraper()
-        
+    @classmethod
+    def setUpClass(cls):
+        # One scraper for the whole class; starting a browser per test
+        # method is pure startup overhead
+        cls.scraper = CompanyScraper()
+
         # Load test company data
         data_path = Path(__file__).parent / 'data' / 'test_companies.json'
         with open(data_path, 'r', encoding='utf-8') as f:
-            self.test_companies = json.load(f)
-    
-    def tearDown(self):
-        if hasattr(self, 'scraper') and hasattr(self.scraper, 'driver'):
-            self.scraper.driver.quit()
+            cls.test_companies = json.load(f)
+
+    @classmethod
+    def tearDownClass(cls):
+        if hasattr(cls, 'scraper') and hasattr(cls.scraper, 'driver'):
+            cls.scraper.driver.quit()
     
     @pytest.mark.branches
     def test_branch_detection_real_companies(self):